@@ -1,10 +1,28 @@
+import os
+import glob
+import hashlib
 import pandas as pd
 import numpy as np
+import numexpr as ne
+import numba
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import polars as pl
 import statsmodels.formula.api as smf
 
 WRITE_ON=False
 # sp far w.r.t gvkey as the query parameter
 WRITE_SPLIT_THRESHOLD=5000
+# directory of the cached loader results
+CACHE_DIR=".cache"
+# columns of the raw tables that are used in processing (the only ones read, 
+# besides any to be kept, when keep_cols is given), and the only ones whose 
+# missing values cause rows to be dropped
+SECURITY_RETURNS_COLS=[
+    "gvkey", "iid", "datadate", "prccm", "ajexm", "trfm", "cshom", "curcdm"
+]
+FUNDAMENTALS_COLS=["gvkey", "fyear", "curcd", "at", "ceq", "oiadp", "revt"]
 
 def write_ids(
     df, idname, filename, 
@@ -24,27 +42,90 @@ def write_ids(
         return
 
     id_vals = df.index.get_level_values(idname) if from_index else df[idname]
-    id_vals = list(id_vals.dropna().unique())
+    id_vals = pd.Series(id_vals.dropna().unique())
     
-    current_split = 0
-    current_split_rows = 0
-    i = 0 # idx of next value to be written
-    while i < len(id_vals):
-        fh = open(f"p{current_split}_{filename}", "w")
-        while i < len(id_vals) and current_split_rows < WRITE_SPLIT_THRESHOLD:
-            idval = id_vals[i]
-            fh.write(f"{idval}\n")
-            i += 1
-            current_split_rows += 1
-        fh.close()
-        current_split += 1
-        current_split_rows = 0
+    # each split file holds up to WRITE_SPLIT_THRESHOLD values, written in one go
+    for current_split, i in enumerate(range(0, len(id_vals), WRITE_SPLIT_THRESHOLD)):
+        id_vals.iloc[i:i + WRITE_SPLIT_THRESHOLD].to_csv(
+            f"p{current_split}_{filename}", 
+            index=False, header=False, lineterminator="\n", 
+        )
+
+
+def write_atomic(write, filename):
+    """ Writes a file by way of a temporary file in the same directory, which is 
+    only moved into place once complete, so that an interrupted write never 
+    leaves a truncated file under the final name. 
+
+    Args:
+        write: function that writes the file to the filename it is given.
+        filename: The final name of the file.
+    """
+    tmp_filename = f"{filename}.tmp"
+    try:
+        write(tmp_filename)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def parquet_sidecar(filename, dtype=None, **csv_kwargs):
+    """ Returns the name of the cached parquet sidecar (filename + ".parquet") 
+    of a csv file, so that the csv only has to be parsed once. The sidecar 
+    records the modification time and size of the csv it was built from, and 
+    is (re)built if it is missing or these no longer match the csv.
+
+    Args:
+        filename: The name of the csv file.
+        dtype: dict of column names to dtypes, for the csv read.
+        csv_kwargs: Further arguments for the csv read e.g. parse_dates.
+    """
+    parquet_filename = f"{filename}.parquet"
+    csv_stat = f"{os.stat(filename).st_mtime_ns},{os.stat(filename).st_size}".encode()
+    if (
+        not os.path.exists(parquet_filename) 
+        or (pq.read_schema(parquet_filename).metadata or {}).get(b"csv_stat") != csv_stat
+    ):
+        df = pd.read_csv(filename, engine="pyarrow", dtype=dtype, **csv_kwargs)
+        table = pa.Table.from_pandas(df)
+        table = table.replace_schema_metadata(
+            {**table.schema.metadata, b"csv_stat": csv_stat}
+        )
+        write_atomic(
+            lambda tmp_filename: pq.write_table(table, tmp_filename, compression="zstd"), 
+            parquet_filename, 
+        )
+    return parquet_filename
+
+
+def read_table(filename, columns=None, dtype=None, **csv_kwargs):
+    """ Reads a table from a csv file, by way of its parquet sidecar. 
+
+    Args:
+        filename: The name of the csv file.
+        columns: list of columns to read, the rest are pruned at the scan. All 
+            columns are read if not specified.
+        dtype: dict of column names to dtypes, applied to the columns that are 
+            read.
+        csv_kwargs: Further arguments for the one-off csv read e.g. parse_dates.
+    """
+    # always read from the sidecar, so that dtypes are consistent between the 
+    # first and subsequent runs
+    df = pd.read_parquet(parquet_sidecar(filename, dtype, **csv_kwargs), columns=columns)
+    # (no-op unless the sidecar predates the dtypes)
+    if dtype is not None:
+        df = df.astype({col: dtype[col] for col in df.columns if col in dtype})
+    return df
 
 
 def read_emissions(filename):
-    return pd.read_csv(
+    return read_table(
         filename, 
-        dtype={"gvkey": "str"}, #identifiers
+        dtype={
+            "companyid": pd.ArrowDtype(pa.string()), 
+            "gvkey": pd.ArrowDtype(pa.string()), 
+        }, #identifiers
         parse_dates=["periodenddate"], 
     )
 
@@ -58,7 +139,7 @@ def write_emission_ids(filename, idname):
 
 def combine_jointables(filenames):
     return pd.concat(
-        [pd.read_csv(fname) for fname in filenames], 
+        [read_table(fname) for fname in filenames], 
         ignore_index=True
     )
 
@@ -78,9 +159,9 @@ def load_emissions(emissions_filename, cid_gvkey_mappings):
     # non-null allows us to finally change it to integer
     emissions["gvkey"] = emissions["gvkey"].astype(int)
     # 1 to 1 to prevent redundant/conflicting emissions information
-    emissions = emissions[
-        np.isin(emissions["gvkey"], cid_gvkey_mappings["gvkey"])
-    ]
+    # (gvkeys of the mappings aligned to the same integer type, for hashing)
+    valid_gvkeys = pd.Index(cid_gvkey_mappings["gvkey"].dropna().astype(int).unique())
+    emissions = emissions[emissions["gvkey"].isin(valid_gvkeys)]
     # remove surplus columns
     emissions = emissions.drop(
         columns=[
@@ -103,18 +184,100 @@ def load_emissions(emissions_filename, cid_gvkey_mappings):
     return emissions
 
 
+def cached(name, build, sources, params=()):
+    """ Returns the dataframe built by the given function, by way of a result 
+    cache of one Arrow IPC (feather) file per result in CACHE_DIR. The entry 
+    records a key of the path, size and modification time of the source files, 
+    any other parameters of the build, and a hash of this module's code, and is 
+    rebuilt (replacing the file) when the key changes, so neither a changed 
+    input nor a changed loader is ever served stale. 
+
+    Args:
+        name: Name of the result, used for the cache file.
+        build: function, without arguments, that builds the dataframe.
+        sources: list of the names of the files that the result is built from.
+        params: other values that the result depends on, must have a stable 
+            repr.
+    """
+    source_stats = [
+        (
+            os.path.abspath(source), 
+            os.stat(source).st_mtime_ns, 
+            os.stat(source).st_size, 
+        ) 
+        for source in sources
+    ]
+    # the loaders and the helpers they use all live in this module
+    with open(__file__, "rb") as fh:
+        code_hash = hashlib.md5(fh.read()).hexdigest()
+    key = hashlib.md5(repr((source_stats, params, code_hash)).encode()).hexdigest()
+    cache_filename = os.path.join(CACHE_DIR, f"{name}.feather")
+    if os.path.exists(cache_filename):
+        # only the schema is read to check the key
+        with pa.memory_map(cache_filename) as source:
+            cached_key = (pa.ipc.open_file(source).schema.metadata or {}).get(b"cache_key")
+        if cached_key == key.encode():
+            return pd.read_feather(cache_filename)
+
+    df = build()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # (pyarrow keeps the index, unlike DataFrame.to_feather)
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata(
+        {**table.schema.metadata, b"cache_key": key.encode()}
+    )
+    write_atomic(
+        lambda tmp_filename: feather.write_feather(table, tmp_filename, compression="lz4"), 
+        cache_filename, 
+    )
+    # remove any entries left from when each key had its own file
+    for old_cache_filename in glob.glob(os.path.join(CACHE_DIR, f"{name}_*.feather")):
+        os.remove(old_cache_filename)
+    return df
+
+
+class LazyFrame:
+    """ A dataframe whose loading is deferred until it is first needed, so that 
+    loaders whose results go unused are never run. """
+
+    def __init__(self, build, sources):
+        """ 
+        Args:
+            build: function, without arguments, that loads the dataframe.
+            sources: list of the names of the files that the dataframe is 
+                loaded from, for keying results that depend on it.
+        """
+        self._build = build
+        self._df = None
+        self.sources = sources
+
+    def collect(self):
+        """ Returns the dataframe, loading it on the first call only. """
+        if self._df is None:
+            self._df = self._build()
+        return self._df
+
+
 def load_exrts(filename):
-    """ load daily currency rates, return monthly rates """
+    """ load daily currency rates, return monthly rates, lazily """
+    return LazyFrame(
+        lambda: cached("exrts", lambda: _load_exrts(filename), [filename]), 
+        [filename], 
+    )
+
 
-    d_exrts = pd.read_csv(
+def _load_exrts(filename):
+
+    d_exrts = read_table(
         filename, 
+        dtype={"curd": "category"}, 
         parse_dates=["datadate"], 
     )
     d_exrts = d_exrts.sort_values(["curd", "datadate"])
     d_exrts["data_ym"] = d_exrts["datadate"].dt.to_period('M')
 
     m_exrts = d_exrts.groupby(
-        ["curd", "data_ym"]
+        ["curd", "data_ym"], sort=False, observed=True
     ).last(
     ).drop(
         columns="datadate"
@@ -124,7 +287,15 @@ def load_exrts(filename):
 
 
 def load_market_returns(filename):
-    mkt_rets = pd.read_csv(
+    """ load market prices, return monthly market returns, lazily """
+    return LazyFrame(
+        lambda: cached("market_returns", lambda: _load_market_returns(filename), [filename]), 
+        [filename], 
+    )
+
+
+def _load_market_returns(filename):
+    mkt_rets = read_table(
         filename, 
         parse_dates=["datadate"], 
     )
@@ -141,6 +312,121 @@ def load_market_returns(filename):
     return mkt_rets
 
 
+def lookup_rates(rates, currencies, periods):
+    """ Looks up the rates for each (currency, period) pair by gathering from a 
+    dense (currency x period) table, in place of a merge on the keys. 
+
+    Args:
+        rates: dataframe of rates, indexed by currency and then by period, where 
+            the periods are monthly periods or integers e.g. years.
+        currencies: array of the currency of each row to look up.
+        periods: integer array of the period of each row to look up, as month 
+            ordinals for monthly periods.
+
+    Returns:
+        array with a column for each column of rates, NaN where there is no rate
+    """
+    rate_periods = rates.index.get_level_values(1)
+    rate_periods = (
+        rate_periods.asi8 if isinstance(rate_periods, pd.PeriodIndex) 
+        else rate_periods.to_numpy(dtype=np.int64)
+    )
+    cur_codes, cur_levels = pd.factorize(rates.index.get_level_values(0))
+    base_period = rate_periods.min()
+    n_periods = rate_periods.max() - base_period + 1
+    # build the table once
+    table = np.full((len(cur_levels), n_periods, rates.shape[1]), np.nan)
+    table[cur_codes, rate_periods - base_period] = rates.to_numpy(dtype=float)
+    # gather, leaving NaN for currencies/periods outside the table
+    cur_idx = cur_levels.get_indexer(currencies)
+    period_idx = np.asarray(periods, dtype=np.int64) - base_period
+    found = (cur_idx >= 0) & (period_idx >= 0) & (period_idx < n_periods)
+    looked_up = np.full((len(cur_idx), rates.shape[1]), np.nan)
+    looked_up[found] = table[cur_idx[found], period_idx[found]]
+    return looked_up
+
+
+def finite_mask(df, cols):
+    """ Returns a boolean array of whether the values of the given columns are 
+    all finite (neither missing nor infinite) in each row of the dataframe, 
+    evaluated in a single pass. 
+
+    Args:
+        df: Dataframe.
+        cols: list of the names of the (numeric) columns to check.
+    """
+    col_vals = {f"col{i}": df[col].to_numpy() for i, col in enumerate(cols)}
+    return ne.evaluate(
+        " & ".join(f"isfinite({name})" for name in col_vals), 
+        local_dict=col_vals, 
+    )
+
+
+def shift_within_groups(values, group_codes):
+    """ Shifts the rows of an array one forward within each group of contiguous 
+    rows, like a grouped shift(), so the first row of each group becomes NaN. 
+
+    Args:
+        values: array of the values, with rows in group order.
+        group_codes: array of the group code of each row.
+    """
+    # (floating inputs keep their precision, e.g. float32 stays float32)
+    shifted = np.empty(values.shape, dtype=np.result_type(values.dtype, np.float32))
+    shifted[0] = np.nan
+    shifted[1:] = values[:-1]
+    shifted[1:][group_codes[1:] != group_codes[:-1]] = np.nan
+    return shifted
+
+
+@numba.njit(cache=True, nogil=True, error_model="numpy")
+def rolling_beta(x, y, group_starts, window):
+    """ Computes rolling betas of x on y, i.e. cov(x,y) / var(y), over windows of 
+    the given number of rows, separately within each group of contiguous rows. 
+    Running sums are kept so that each row is only added and removed once. 
+
+    Args:
+        x: array of the dependent values e.g. security returns.
+        y: array of the independent values e.g. market returns.
+        group_starts: sorted array of the starting row of each group, followed 
+            by the total number of rows.
+        window: number of rows in each window.
+
+    Returns:
+        array of betas, NaN where the window is incomplete, has missing values 
+        or has no variance in y
+    """
+    betas = np.full(len(x), np.nan)
+    for g in range(len(group_starts) - 1):
+        start, end = group_starts[g], group_starts[g + 1]
+        sx = sy = sxy = syy = 0.0
+        n = 0 # count of valid (x, y) pairs in the window
+        for i in range(start, end):
+            # add the row entering the window
+            if np.isfinite(x[i]) and np.isfinite(y[i]):
+                sx += x[i]
+                sy += y[i]
+                sxy += x[i] * y[i]
+                syy += y[i] * y[i]
+                n += 1
+            # remove the row leaving the window
+            j = i - window
+            if j >= start and np.isfinite(x[j]) and np.isfinite(y[j]):
+                sx -= x[j]
+                sy -= y[j]
+                sxy -= x[j] * y[j]
+                syy -= y[j] * y[j]
+                n -= 1
+            # only full windows give a beta
+            if n == window:
+                cov = (sxy - sx * sy / n) / (n - 1)
+                var = (syy - sy * sy / n) / (n - 1)
+                # a constant y gives no beta, where rounding left over in the 
+                # running sums is not mistaken for variance
+                if var > 1e-12 * (syy / n):
+                    betas[i] = cov / var
+    return betas
+
+
 def load_security_returns(
     filename, m_exrts, mkt_rets, 
     drop_outliers=[], keep_cols=None
@@ -149,92 +435,115 @@ def load_security_returns(
     like betas. 
     
     Args:
+        m_exrts: LazyFrame of the monthly exchange rates.
+        mkt_rets: LazyFrame of the monthly market returns.
         drop_outliers: list of column names whose outliers should be dropped at 
             finalisation.
         keep_cols: list of columns that will be kept at finalisation, the rest 
-            of the columns will be discarded.
+            of the columns will be discarded. Raw columns that are neither kept 
+            nor used in processing are then not read at all. Either way, rows 
+            are only dropped for missing values in the columns used in 
+            processing, so kept raw columns may have missing values.
     """
-    security_returns = pd.read_csv(
-        filename, 
-        parse_dates=["datadate"], 
+    return cached(
+        "security_returns", 
+        lambda: _load_security_returns(
+            filename, m_exrts, mkt_rets, drop_outliers, keep_cols
+        ), 
+        [filename] + m_exrts.sources + mkt_rets.sources, 
+        (drop_outliers, keep_cols), 
     )
-    security_returns["data_ym"] = security_returns["datadate"].dt.to_period('M')
 
-    # remove missing values of prices, return factors, adjustment factors
-    security_returns = security_returns.dropna()
+
+def _load_security_returns(
+    filename, m_exrts, mkt_rets, 
+    drop_outliers=[], keep_cols=None
+):
+    id_dtypes = {"iid": "category", "curcdm": "category"}
+    # the row-wise preprocessing and the sort are run as a polars query over 
+    # the parquet sidecar, on its streaming engine, and only the result is 
+    # handed to pandas
+    security_returns = pl.scan_parquet(
+        parquet_sidecar(filename, id_dtypes, parse_dates=["datadate"])
+    )
+    # when only some columns are to be kept, just those and the columns used 
+    # in processing are read
+    if keep_cols is not None:
+        security_returns = security_returns.select(
+            SECURITY_RETURNS_COLS + [
+                col for col in security_returns.collect_schema().names() 
+                if col in keep_cols and col not in SECURITY_RETURNS_COLS
+            ]
+        )
+    security_returns = security_returns.with_columns(
+        # (plain strings so that the sort is lexical, as in pandas)
+        pl.col(list(id_dtypes)).cast(pl.String), 
+    ).drop_nulls(
+        # remove missing values of prices, return factors, adjustment factors 
+        # (only the columns used in processing, whichever columns are read, so 
+        # that keep_cols never changes which rows are kept)
+        subset=SECURITY_RETURNS_COLS, 
+    ).with_columns(
+        # single precision is enough for the inputs to the return and market 
+        # value arithmetic, and halves the memory it has to move (betas stay 
+        # in double)
+        pl.col(["prccm", "ajexm", "trfm", "cshom"]).cast(pl.Float32), 
+    ).with_columns(
+        # prices for returns
+        adjclose=(pl.col("prccm") / pl.col("ajexm")) * pl.col("trfm"), 
+    ).sort(
+        ["gvkey", "iid", "datadate"]
+    ).collect(engine="streaming").to_pandas()
+    security_returns = security_returns.astype(id_dtypes)
+    security_returns["data_ym"] = security_returns["datadate"].dt.to_period('M')
 
     # index
     security_returns = security_returns.set_index(["gvkey", "iid", "data_ym"])
-    security_returns = security_returns.sort_index()
-
-    # prices for returns
-    security_returns["adjclose"] = (security_returns["prccm"] / security_returns["ajexm"]) * security_returns["trfm"]
+    # already sorted by the query, and kept sorted from here on (no resets of 
+    # the index), which the contiguous issue handling below relies on
+    if not security_returns.index.is_monotonic_increasing:
+        raise ValueError("security returns are not sorted by (gvkey, iid, data_ym)")
+    # integer codes for the issues, (gvkey, iid), to group on from here on
+    issue_codes = pd.factorize(security_returns.index.droplevel("data_ym"))[0]
 
     # join exchange rates to account for the effect of their fluctuations on returns
-    security_returns = security_returns.reset_index().merge(
-        m_exrts, 
-        how="left", 
-        left_on=["curcdm", "data_ym"], 
-        right_index=True, 
-    ).set_index(
-        ["gvkey", "iid", "data_ym"]
-    )
-    # compute raw local and FX returns
-    security_returns = pd.concat(
-        [
-            security_returns, 
-            security_returns.groupby(
-                level=["gvkey", "iid"]
-            )[["adjclose", "exratd_toUSD", "exratd_toGBP"]].pct_change(
-            ).rename(
-                columns={
-                    "adjclose": "local_ret", 
-                    "exratd_toUSD": "USD_fxret", 
-                    "exratd_toGBP": "GBP_fxret", 
-                }
-            )
-        ], 
-        axis=1
-    )
-    # raw returns w.r.t base currencies
-    security_returns["USD_ret"] = (
-        (1 + security_returns["local_ret"]) * (1 + security_returns["USD_fxret"]) - 1
-    )
-    security_returns["GBP_ret"] = (
-        (1 + security_returns["local_ret"]) * (1 + security_returns["GBP_fxret"]) - 1
-    )
+    security_returns[["exratd_toUSD", "exratd_toGBP"]] = lookup_rates(
+        m_exrts.collect()[["exratd_toUSD", "exratd_toGBP"]], 
+        security_returns["curcdm"].to_numpy(), 
+        security_returns.index.get_level_values("data_ym").asi8, 
+    ).astype(np.float32)
+    # compute raw local and FX returns, relative to the previous row of the issue
+    prices = security_returns[["adjclose", "exratd_toUSD", "exratd_toGBP"]].to_numpy()
+    security_returns[
+        ["local_ret", "USD_fxret", "GBP_fxret"]
+    ] = prices / shift_within_groups(prices, issue_codes) - 1
+    # durations of returns in months, that can be used to standardise them, 
+    # from the differences in month ordinals between consecutive rows of an 
+    # issue (rows are sorted, so each issue is contiguous)
+    ym_ordinals = security_returns.index.get_level_values("data_ym").asi8
+    same_issue = issue_codes[1:] == issue_codes[:-1]
+    ret_mfreq = np.full(len(security_returns), np.nan)
+    ret_mfreq[1:][same_issue] = np.diff(ym_ordinals)[same_issue]
 
-    # durations of returns in months, that can be used to standardise them
-    security_returns["ret_mfreq"] = security_returns.reset_index(
-    ).groupby(
-        ["gvkey", "iid"]
-    )["data_ym"].diff(
-    ).apply(
-        lambda x: x.n if pd.notnull(x) else np.nan
-    ).values
-    # standardise returns to monthly frequency
-    security_returns["m_USD_ret"] = (
-        (1 + security_returns["USD_ret"]) ** (1/security_returns["ret_mfreq"])
-    ) - 1
-    # 
-    security_returns["m_GBP_ret"] = (
-        (1 + security_returns["GBP_ret"]) ** (1/security_returns["ret_mfreq"])
-    ) - 1
-    # 
-    security_returns["m_local_ret"] = (
-        (1 + security_returns["local_ret"]) ** (1/security_returns["ret_mfreq"])
-    ) - 1
-    # also convert all the returns from fractions to percentages
-    security_returns["local_ret"] *= 100
-    security_returns["USD_fxret"] *= 100
-    security_returns["GBP_fxret"] *= 100
-    # 
-    security_returns["USD_ret"] *= 100
-    security_returns["GBP_ret"] *= 100
-    # 
-    security_returns["m_USD_ret"] *= 100
-    security_returns["m_GBP_ret"] *= 100
-    security_returns["m_local_ret"] *= 100
+    # raw returns w.r.t base currencies
+    local_ret = security_returns["local_ret"].to_numpy()
+    USD_fxret = security_returns["USD_fxret"].to_numpy()
+    GBP_fxret = security_returns["GBP_fxret"].to_numpy()
+    USD_ret = ne.evaluate("(1 + local_ret) * (1 + USD_fxret) - 1")
+    GBP_ret = ne.evaluate("(1 + local_ret) * (1 + GBP_fxret) - 1")
+    # standardise returns to monthly frequency, and also convert all the 
+    # returns from fractions to percentages (each fused into a single pass)
+    security_returns = security_returns.assign(**{
+        "local_ret": ne.evaluate("local_ret * 100"), 
+        "USD_fxret": ne.evaluate("USD_fxret * 100"), 
+        "GBP_fxret": ne.evaluate("GBP_fxret * 100"), 
+        "USD_ret": ne.evaluate("USD_ret * 100"), 
+        "GBP_ret": ne.evaluate("GBP_ret * 100"), 
+        "ret_mfreq": ret_mfreq, 
+        "m_USD_ret": ne.evaluate("((1 + USD_ret) ** (1 / ret_mfreq) - 1) * 100"), 
+        "m_GBP_ret": ne.evaluate("((1 + GBP_ret) ** (1 / ret_mfreq) - 1) * 100"), 
+        "m_local_ret": ne.evaluate("((1 + local_ret) ** (1 / ret_mfreq) - 1) * 100"), 
+    })
 
     # market value
     security_returns["local_mktval"] = security_returns["cshom"] * security_returns["prccm"]
@@ -243,55 +552,52 @@ def load_security_returns(
     # shift one forward to prevent look-ahead bias
     security_returns[
         ["local_mktval", "USD_mktval", "GBP_mktval"]
-    ] = security_returns.groupby(
-        level=["gvkey", "iid"]
-    )[
-        ["local_mktval", "USD_mktval", "GBP_mktval"]
-    ].shift()
+    ] = shift_within_groups(
+        security_returns[["local_mktval", "USD_mktval", "GBP_mktval"]].to_numpy(), 
+        issue_codes, 
+    )
 
     # compute beta on security return, joining market returns for this purpose
-    security_returns = security_returns.join(
-        mkt_rets, 
-        how="left", 
-        on="data_ym", 
-    )
-    # variances and covariances
+    security_returns["m_mktret"] = mkt_rets.collect()["m_mktret"].reindex(
+        security_returns.index.get_level_values("data_ym")
+    ).to_numpy()
+    # rolling betas over 12 observations, within issues
     security_return_label = "m_local_ret" # designates the return of interest
-    security_betas = security_returns.reset_index(
-    ).groupby(
-        ["gvkey", "iid"] # within issues
-    )[[security_return_label, "m_mktret"]].rolling(
-        12
-    ).cov().unstack()["m_mktret"].rename(
-        columns={
-            security_return_label: "cov(i,m)", 
-            "m_mktret": "var(m)", 
-        }
-    ).set_index(security_returns.index)
-    # beta only
-    security_betas["beta"] = security_betas["cov(i,m)"] / security_betas["var(m)"]
-    security_betas = security_betas.drop(columns=["cov(i,m)", "var(m)"])
-    # shfit one forward to prevent look-ahead bias
-    security_betas = security_betas.groupby(
-        level=["gvkey", "iid"]
-    ).shift()
-    # combine beta back into the main data
-    security_returns = pd.concat([security_returns, security_betas], axis=1)
+    issue_starts = np.r_[0, np.flatnonzero(np.diff(issue_codes)) + 1, len(issue_codes)]
+    security_betas = rolling_beta(
+        security_returns[security_return_label].to_numpy(), 
+        security_returns["m_mktret"].to_numpy(), 
+        issue_starts, 
+        12, 
+    )
+    # shfit one forward to prevent look-ahead bias, combining beta back into 
+    # the main data
+    security_returns["beta"] = shift_within_groups(security_betas, issue_codes)
 
     # finalise the data, dropping due to the missing values from the 
-    # shifts, return calculations, etc
-    security_returns = security_returns.dropna()
+    # shifts, return calculations, etc - the raw columns used are complete, 
+    # and every other column that can be missing feeds into one of these
+    security_returns = security_returns[
+        finite_mask(
+            security_returns, 
+            [
+                "m_USD_ret", "m_GBP_ret", "m_local_ret", 
+                "local_mktval", "USD_mktval", "GBP_mktval", 
+                "m_mktret", "beta", 
+            ], 
+        )
+    ]
     # removal of rows with outliers is also possible: "m_USD_ret", "beta", "USD_mktval"
     if len(drop_outliers) > 0:
-        keep_idx = pd.Series(True, index=security_returns.index)
+        keep_idx = np.ones(len(security_returns), dtype=bool)
         for drop_col in drop_outliers:
-            keep_idx &= (
-                (security_returns[drop_col].quantile(0.001) < security_returns[drop_col])
-                & (security_returns[drop_col] < security_returns[drop_col].quantile(0.999))
-            )
+            col_vals = security_returns[drop_col].to_numpy()
+            # both bounds from a single quantile computation
+            lo, hi = np.quantile(col_vals, [0.001, 0.999])
+            keep_idx &= ne.evaluate("(col_vals > lo) & (col_vals < hi)")
         security_returns = security_returns[keep_idx]
     # Prepare for linking based on the prior year - for fundamentals and emissions
-    security_returns["datayear"] = security_returns.reset_index()["data_ym"].dt.year.values
+    security_returns["datayear"] = security_returns.index.get_level_values("data_ym").year
     security_returns["datayear-1"] = security_returns["datayear"] - 1
     # filtering down of the columns, to those that are relevant, is also possible
     if keep_cols is not None:
@@ -304,53 +610,85 @@ def load_fundamentals(filename, m_exrts, keep_cols=None):
     """ 
     
     Args:
+        m_exrts: LazyFrame of the monthly exchange rates.
+        keep_cols: list of columns that will be kept at finalisation, the rest 
+            of the columns will be discarded. Raw columns that are neither kept 
+            nor used in processing are then not read at all. Either way, rows 
+            are only dropped for missing values in the columns used in 
+            processing, so kept raw columns may have missing values.
 
     Returns:
-        loaded dataframe with the relevant company fundamentals information
+        LazyFrame that loads the relevant company fundamentals information
     """
-    fundamentals = pd.read_csv(
+    sources = [filename] + m_exrts.sources
+    return LazyFrame(
+        lambda: cached(
+            "fundamentals", 
+            lambda: _load_fundamentals(filename, m_exrts, keep_cols), 
+            sources, 
+            keep_cols, 
+        ), 
+        sources, 
+    )
+
+
+def _load_fundamentals(filename, m_exrts, keep_cols=None):
+    fundamentals_dtypes = {"curcd": "category"}
+    # when only some columns are to be kept, just those and the columns used 
+    # in processing are read
+    read_cols = None
+    if keep_cols is not None:
+        read_cols = FUNDAMENTALS_COLS + [
+            col for col in pq.read_schema(
+                parquet_sidecar(filename, fundamentals_dtypes, parse_dates=["datadate"])
+            ).names 
+            if col in keep_cols and col not in FUNDAMENTALS_COLS
+        ]
+    fundamentals = read_table(
         filename, 
-        parse_dates=["datadate"]
+        columns=read_cols, 
+        dtype=fundamentals_dtypes, 
+        parse_dates=["datadate"], 
     )
     fundamentals = fundamentals.rename(columns={"fyear": "fiscalyear"})
     # consolidate double-reporting, per fiscal year, by companies (occurs due 
     # to different reporting formats)
     fundamentals = fundamentals.groupby(
-        ["gvkey", "fiscalyear"]
+        ["gvkey", "fiscalyear"], sort=False, observed=True
     ).first()
     # ensure proper sorting on this new index
     fundamentals = fundamentals.sort_index()
-    # drop rows if there are still any null values left despite consolidation
-    fundamentals = fundamentals.dropna()
+    # drop rows if there are still any null values left despite consolidation 
+    # (in the columns used in processing only, whichever columns are read, so 
+    # that keep_cols never changes which rows are kept)
+    fundamentals = fundamentals.dropna(
+        subset=["curcd", "at", "ceq", "oiadp", "revt"]
+    )
 
     # standardise values to USD, processing exchange rates so that they are 
     # appropriate for this purpose, and then joining them so that they can 
     # be applied.
-    m_exrts_flat = m_exrts.reset_index()
+    m_exrts_flat = m_exrts.collect().reset_index()
     m_exrts_flat["datayear"] = m_exrts_flat["data_ym"].dt.year
     # yearly balance sheet figures conversion rates
     y_bs_exrts = m_exrts_flat.drop(columns="data_ym").groupby(
-        ["curd", "datayear"]
+        ["curd", "datayear"], sort=False, observed=True
     ).last()[["exratd_toUSD"]].rename(
         columns={"exratd_toUSD": "bs_toUSD"}
     )
     # yearly income statement figures conversion rates
     y_is_exrts = m_exrts_flat.drop(columns="data_ym").groupby(
-        ["curd", "datayear"]
+        ["curd", "datayear"], sort=False, observed=True
     ).mean()[["exratd_toUSD"]].rename(columns={"exratd_toUSD": "is_toUSD"})
-    # combine the above two sets of rates
-    y_fs_exrts = pd.concat(
-        [y_bs_exrts, y_is_exrts], 
-        axis=1
-    )
+    # combine the above two sets of rates (both come from the same grouping, 
+    # so their rows already line up)
+    y_fs_exrts = y_bs_exrts
+    y_fs_exrts["is_toUSD"] = y_is_exrts["is_toUSD"].to_numpy()
     # join them to the main table
-    fundamentals = fundamentals.reset_index().merge(
-        y_fs_exrts, 
-        how="left", 
-        left_on=["curcd", "fiscalyear"], 
-        right_index=True, 
-    ).set_index(
-        ["gvkey", "fiscalyear"]
+    fundamentals[["bs_toUSD", "is_toUSD"]] = lookup_rates(
+        y_fs_exrts[["bs_toUSD", "is_toUSD"]], 
+        fundamentals["curcd"].to_numpy(), 
+        fundamentals.index.get_level_values("fiscalyear").to_numpy(), 
     )
     # apply the rates
     fundamentals["at"] *= fundamentals["bs_toUSD"]
@@ -361,7 +699,7 @@ def load_fundamentals(filename, m_exrts, keep_cols=None):
 
     # determine investment in each year by percentage change in assets
     fundamentals["investment"] = fundamentals.groupby(
-        level="gvkey"
+        level="gvkey", sort=False, observed=True
     )["at"].pct_change()
     # null for the first fiscalyear entry for companies
 
@@ -369,9 +707,15 @@ def load_fundamentals(filename, m_exrts, keep_cols=None):
     fundamentals["opm"] = fundamentals["oiadp"] / fundamentals["revt"]
     # some inf values can be caused here due to div by 0
 
-    # finalise the data, dropping all rows with null or non-finite values
-    with pd.option_context('mode.use_inf_as_null', True):
-        fundamentals = fundamentals.dropna()
+    # finalise the data, dropping all rows with null or non-finite values 
+    # (only the converted values and those derived from them can be missing 
+    # after the earlier dropna, and only investment and opm can be infinite)
+    fundamentals = fundamentals[
+        finite_mask(
+            fundamentals, 
+            ["at", "ceq", "oiadp", "revt", "investment", "opm"], 
+        )
+    ]
     # filtering down of the columns is also possible
     if keep_cols is not None:
         fundamentals = fundamentals[keep_cols]
@@ -399,7 +743,7 @@ def main():
         "na_fundamentals_2014to2024.csv", m_exrts, 
         
     )
-    print(na_fundamentals)
+    print(na_fundamentals.collect())
     
     # drop_outliers=["m_USD_ret", "beta", "USD_mktval"]
     # keep_cols=["datayear-1", "beta", "USD_mktval", "m_USD_ret"]